@@ -3,72 +3,193 @@
 并行下载 zip_links.txt 中的所有 ZIP 链接
 """
 import os
+import shutil
 import sys
-import time
 from pathlib import Path
+from urllib.parse import urlsplit
 from concurrent.futures import ThreadPoolExecutor, as_completed
 import requests
+import urllib3
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 from tqdm import tqdm
 
+def _workers() -> int:
+    """线程数默认随 CPU 数缩放；DOWNLOAD_WORKERS 可以覆盖，至少为 1"""
+    raw = os.environ.get("DOWNLOAD_WORKERS")
+    if not raw:
+        return min(32, (os.cpu_count() or 1) * 5)  # GitHub-hosted runner 通常是 2 vCPU
+    try:
+        return max(1, int(raw))
+    except ValueError:
+        print(f"❌ DOWNLOAD_WORKERS 必须是整数，当前为 {raw!r}")
+        sys.exit(1)
+
 LINKS_FILE = "zip_links.txt"
 DOWNLOAD_DIR = Path("downloads")
-WORKERS = min(32, (os.cpu_count() or 1) * 5)  # GitHub-hosted runner 通常是 2 vCPU
-CHUNK = 8192
+# 下载是 I/O 密集型，线程阻塞在 recv 时会释放 GIL；可用 DOWNLOAD_WORKERS 覆盖默认上限
+WORKERS = _workers()
+CHUNK = 1 << 20          # 每次 1 MiB，减少 iter_content 循环和进度条刷新次数
+WRITE_BUFFER = 1 << 20   # 写缓冲，攒够 1 MiB 再落盘，减少 write(2) 次数
+BAR_STEP = 4 << 20       # 每个线程攒够 4 MiB 才更新一次共享进度条
+SMALL_FILE = 4 << 20     # 不超过此大小的文件一次读完、一次写入
 TIMEOUT = 30
 RETRY = 3
 
 session = requests.Session()
 session.headers.update({"User-Agent": "github-actions/zip-downloader"})
+# 重试交给连接池：带抖动的指数退避，429/503 时遵从服务端的 Retry-After
+retry = Retry(
+    total=RETRY,
+    backoff_factor=0.5,
+    backoff_jitter=0.5,
+    status_forcelist=[429, 500, 502, 503, 504],
+    respect_retry_after_header=True,
+    raise_on_status=False,
+)
+# 默认连接池只有 10 个连接，线程多于此数时会反复关闭/新建连接
+adapter = HTTPAdapter(
+    pool_connections=WORKERS, pool_maxsize=WORKERS, pool_block=True, max_retries=retry
+)
+session.mount("https://", adapter)
+session.mount("http://", adapter)
 
-def read_links(path: str):
+def read_links(path: str) -> list[str]:
     if not Path(path).is_file():
         print(f"❌ {path} 不存在")
         sys.exit(1)
-    with open(path, encoding="utf-8") as f:
-        for line in f:
-            line = line.strip()
-            if line and not line.startswith("#"):
-                yield line
+    lines = Path(path).read_text(encoding="utf-8").splitlines()
+    return [s for s in (ln.strip() for ln in lines) if s and not s.startswith("#")]
+
+def _advance(bar: tqdm, n: int = 0, total: int = 0):
+    """多个线程共用一个字节进度条，计数和总量都在锁内修改"""
+    with bar.get_lock():
+        bar.total += total
+        bar.update(n)
+
+def _preallocate(f, size: int):
+    """已知大小时一次性预留磁盘空间，避免边写边扩展带来的碎片和元数据更新"""
+    if size <= 0 or not hasattr(os, "posix_fallocate"):
+        return
+    try:
+        os.posix_fallocate(f.fileno(), 0, size)
+    except OSError:
+        pass   # 文件系统不支持时照常边写边分配
+
+class _CountingWriter:
+    """包装文件对象：写入时累计字节数，攒够 BAR_STEP 再更新共享进度条"""
+
+    def __init__(self, f, bar: tqdm | None):
+        self.f = f
+        self.bar = bar
+        self.pending = 0
+        self.counted = 0   # 已经计入进度条的字节数
+
+    def write(self, data) -> int:
+        n = self.f.write(data)
+        self.pending += n
+        if self.pending >= BAR_STEP:
+            self.flush()
+        return n
+
+    def flush(self):
+        if self.bar is not None:
+            _advance(self.bar, self.pending)
+            self.counted += self.pending
+        self.pending = 0
 
-def _fetch(url: str, dest: Path):
+def _warm_up(links: list[str]):
+    """每个主机先串行做一次 DNS 解析 + TLS 握手，连接放回池里供下载线程直接复用"""
+    # 必须走同一个 adapter 才能预热它的连接池，但预热期间关掉重试：
+    # 不值得为 503 / Retry-After 在启动阶段干等
+    adapter.max_retries = Retry(0, read=False)
+    try:
+        for origin in dict.fromkeys(f"{p.scheme}://{p.netloc}/" for p in map(urlsplit, links)):
+            try:
+                session.head(origin, timeout=5, allow_redirects=False)
+            except requests.RequestException:
+                pass   # 预热失败不影响正式下载
+    finally:
+        adapter.max_retries = retry
+
+def _already_downloaded(url: str, target: Path) -> int:
+    """target 已存在且和远端大小一致时返回该大小，否则返回 0"""
+    if not target.exists():
+        return 0
+    try:
+        # 用 HEAD 而不是 GET：没有正文，连接可以放回连接池
+        r = session.head(url, timeout=TIMEOUT, allow_redirects=True)
+    except requests.RequestException:
+        return 0
+    size = int(r.headers.get("content-length") or 0)
+    # 带 Content-Encoding 时长度是编码后的，和磁盘上的大小没法比
+    if not r.ok or not size or "content-encoding" in r.headers:
+        return 0
+    return size if target.stat().st_size == size else 0
+
+def _fetch(url: str, dest: Path, bar: tqdm):
     """真正下载的函数，支持重试"""
+    fname = Path(url).name or "download.zip"
+    target = dest / fname
+    part = target.with_name(fname + ".part")   # 下完再改名，target 存在即说明是完整文件
+    target.parent.mkdir(parents=True, exist_ok=True)
+
+    done = _already_downloaded(url, target)
+    if done:
+        _advance(bar, done, done)   # 之前已完整下载过，不再拉取正文
+        return url, True
+
     for attempt in range(1, RETRY + 1):
+        total = 0
+        out = None
         try:
             with session.get(url, stream=True, timeout=TIMEOUT) as r:
                 r.raise_for_status()
-                total = int(r.headers.get("content-length", 0))
-                fname = Path(url).name or "download.zip"
-                target = dest / fname
-                target.parent.mkdir(parents=True, exist_ok=True)
-
-                with open(target, "wb") as f, tqdm(
-                    total=total,
-                    unit="B",
-                    unit_scale=True,
-                    desc=f"{fname} ({attempt})",
-                    leave=False,
-                ) as bar:
-                    for chunk in r.iter_content(chunk_size=CHUNK):
-                        if chunk:
-                            f.write(chunk)
-                            bar.update(len(chunk))
+                total = int(r.headers.get("content-length") or 0)
+                if total:
+                    _advance(bar, total=total)
+                if 0 < total <= SMALL_FILE:
+                    # 小文件不走流式循环：一次 read 拿到全部正文，一次写入
+                    part.write_bytes(r.raw.read(decode_content=True))
+                    part.replace(target)
+                    _advance(bar, total)
+                    return url, True
+
+                # 和 iter_content 一样解开 gzip 等传输编码，读写循环交给 shutil
+                r.raw.decode_content = True
+                with open(part, "wb", buffering=WRITE_BUFFER) as f:
+                    _preallocate(f, total)
+                    # 长度未知（chunked）时不计入总进度条，免得总量失真
+                    out = _CountingWriter(f, bar if total else None)
+                    shutil.copyfileobj(r.raw, out, CHUNK)
+                    out.flush()
+                    f.truncate()   # 解码后的实际长度可能小于 content-length
+                part.replace(target)
+                if not total:
+                    tqdm.write(f"📄 {fname} 下载完成（{target.stat().st_size} 字节）")
                 return url, True
         except Exception as e:
-            if attempt == RETRY:
-                return url, False
-            time.sleep(2 ** attempt)
+            # 失败的尝试不计入总进度条，也不留下半截的 .part
+            _advance(bar, -(out.counted if out else 0), -total)
+            part.unlink(missing_ok=True)
+            # 状态码和建连错误已由 Retry 处理；它管不到读正文途中断开，这里整个重下
+            if attempt < RETRY and isinstance(e, urllib3.exceptions.HTTPError):
+                continue
+            return url, False
 
 def main():
     DOWNLOAD_DIR.mkdir(exist_ok=True)
-    links = list(read_links(LINKS_FILE))
+    links = list(dict.fromkeys(read_links(LINKS_FILE)))   # 去重并保持原有顺序
     if not links:
         print("⚠️ 未发现有效链接")
         return
 
+    _warm_up(links)
     print(f"📦 启动 {WORKERS} 线程并行下载 {len(links)} 个文件")
     ok = 0
-    with ThreadPoolExecutor(max_workers=WORKERS) as pool:
-        future_to_url = {pool.submit(_fetch, url, DOWNLOAD_DIR): url for url in links}
+    with tqdm(total=0, unit="B", unit_scale=True, desc="下载") as bar, \
+            ThreadPoolExecutor(max_workers=WORKERS) as pool:
+        future_to_url = {pool.submit(_fetch, url, DOWNLOAD_DIR, bar): url for url in links}
         for fut in tqdm(as_completed(future_to_url), total=len(links), desc="总进度"):
             url, success = fut.result()
             if success:
@@ -83,100 +204,257 @@ if __name__ == "__main__":
 并行下载 zip_links.txt 中的所有 ZIP 链接，
 每 10 个文件打包成一个 bundle-<idx>.zip（放在 bundles/ 目录）。
 """
+import multiprocessing
 import os
+import shutil
 import sys
-import time
 import zipfile
 from pathlib import Path
-from concurrent.futures import ThreadPoolExecutor, as_completed
+from urllib.parse import urlsplit
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
 import requests
+import urllib3
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 from tqdm import tqdm
 
+try:
+    from isal import isal_zlib   # 可选：pip install isal，SIMD 加速的 DEFLATE / CRC32
+except ImportError:
+    isal_zlib = None
+
+def _workers() -> int:
+    """线程数默认随 CPU 数缩放；DOWNLOAD_WORKERS 可以覆盖，至少为 1"""
+    raw = os.environ.get("DOWNLOAD_WORKERS")
+    if not raw:
+        return min(32, (os.cpu_count() or 1) * 5)
+    try:
+        return max(1, int(raw))
+    except ValueError:
+        print(f"❌ DOWNLOAD_WORKERS 必须是整数，当前为 {raw!r}")
+        sys.exit(1)
+
 LINKS_FILE = "zip_links.txt"
 DOWNLOAD_DIR = Path("downloads")
 BUNDLE_DIR   = Path("bundles")
-WORKERS = min(32, (os.cpu_count() or 1) * 5)
-CHUNK = 8192
+WORKERS = _workers()
+CHUNK = 1 << 20          # 每次 1 MiB，减少 iter_content 循环和进度条刷新次数
+WRITE_BUFFER = 1 << 20   # 写缓冲，攒够 1 MiB 再落盘，减少 write(2) 次数
+BAR_STEP = 4 << 20       # 每个线程攒够 4 MiB 才更新一次共享进度条
+SMALL_FILE = 4 << 20     # 不超过此大小的文件一次读完、一次写入
 TIMEOUT = 30
 RETRY = 3
 BUNDLE_SIZE = 10          # 每包文件数
+BUNDLE_COMPRESS = False   # 源文件本身就是 zip，默认只存储不再压缩
 
 session = requests.Session()
 session.headers.update({"User-Agent": "github-actions/zip-downloader"})
+# 重试交给连接池：带抖动的指数退避，429/503 时遵从服务端的 Retry-After
+retry = Retry(
+    total=RETRY,
+    backoff_factor=0.5,
+    backoff_jitter=0.5,
+    status_forcelist=[429, 500, 502, 503, 504],
+    respect_retry_after_header=True,
+    raise_on_status=False,
+)
+# 默认连接池只有 10 个连接，线程多于此数时会反复关闭/新建连接
+adapter = HTTPAdapter(
+    pool_connections=WORKERS, pool_maxsize=WORKERS, pool_block=True, max_retries=retry
+)
+session.mount("https://", adapter)
+session.mount("http://", adapter)
+
+if isal_zlib is not None:
+    # 替换 zipfile 用的整个 zlib 模块：本进程内 zipfile 的压缩、解压、常量和
+    # zlib.error 都改由 isal_zlib 提供（接口与 zlib 兼容）
+    zipfile.zlib = isal_zlib
+    zipfile.crc32 = isal_zlib.crc32
+# ISA-L 的 0 级对不可压缩数据会明显膨胀；1 级对 zlib（1-9）和 ISA-L（0-3）都有效
+COMPRESS_LEVEL = 1
 
 # ---------- 工具函数 ----------
-def read_links(path: str):
+def read_links(path: str) -> list[str]:
     if not Path(path).is_file():
         print(f"❌ {path} 不存在")
         sys.exit(1)
-    with open(path, encoding="utf-8") as f:
-        for line in f:
-            line = line.strip()
-            if line and not line.startswith("#"):
-                yield line
+    lines = Path(path).read_text(encoding="utf-8").splitlines()
+    return [s for s in (ln.strip() for ln in lines) if s and not s.startswith("#")]
+
+def _advance(bar: tqdm, n: int = 0, total: int = 0):
+    """多个线程共用一个字节进度条，计数和总量都在锁内修改"""
+    with bar.get_lock():
+        bar.total += total
+        bar.update(n)
+
+def _preallocate(f, size: int):
+    """已知大小时一次性预留磁盘空间，避免边写边扩展带来的碎片和元数据更新"""
+    if size <= 0 or not hasattr(os, "posix_fallocate"):
+        return
+    try:
+        os.posix_fallocate(f.fileno(), 0, size)
+    except OSError:
+        pass   # 文件系统不支持时照常边写边分配
+
+class _CountingWriter:
+    """包装文件对象：写入时累计字节数，攒够 BAR_STEP 再更新共享进度条"""
+
+    def __init__(self, f, bar: tqdm | None):
+        self.f = f
+        self.bar = bar
+        self.pending = 0
+        self.counted = 0   # 已经计入进度条的字节数
+
+    def write(self, data) -> int:
+        n = self.f.write(data)
+        self.pending += n
+        if self.pending >= BAR_STEP:
+            self.flush()
+        return n
+
+    def flush(self):
+        if self.bar is not None:
+            _advance(self.bar, self.pending)
+            self.counted += self.pending
+        self.pending = 0
 
-def _fetch(url: str, dest: Path):
+def _warm_up(links: list[str]):
+    """每个主机先串行做一次 DNS 解析 + TLS 握手，连接放回池里供下载线程直接复用"""
+    # 必须走同一个 adapter 才能预热它的连接池，但预热期间关掉重试：
+    # 不值得为 503 / Retry-After 在启动阶段干等
+    adapter.max_retries = Retry(0, read=False)
+    try:
+        for origin in dict.fromkeys(f"{p.scheme}://{p.netloc}/" for p in map(urlsplit, links)):
+            try:
+                session.head(origin, timeout=5, allow_redirects=False)
+            except requests.RequestException:
+                pass   # 预热失败不影响正式下载
+    finally:
+        adapter.max_retries = retry
+
+def _already_downloaded(url: str, target: Path) -> int:
+    """target 已存在且和远端大小一致时返回该大小，否则返回 0"""
+    if not target.exists():
+        return 0
+    try:
+        # 用 HEAD 而不是 GET：没有正文，连接可以放回连接池
+        r = session.head(url, timeout=TIMEOUT, allow_redirects=True)
+    except requests.RequestException:
+        return 0
+    size = int(r.headers.get("content-length") or 0)
+    # 带 Content-Encoding 时长度是编码后的，和磁盘上的大小没法比
+    if not r.ok or not size or "content-encoding" in r.headers:
+        return 0
+    return size if target.stat().st_size == size else 0
+
+def _fetch(url: str, dest: Path, bar: tqdm):
     """下载单个文件，返回 (url, local_path | None)"""
+    fname = Path(url).name or "download.zip"
+    target = dest / fname
+    part = target.with_name(fname + ".part")   # 下完再改名，target 存在即说明是完整文件
+    target.parent.mkdir(parents=True, exist_ok=True)
+
+    done = _already_downloaded(url, target)
+    if done:
+        _advance(bar, done, done)   # 之前已完整下载过，不再拉取正文
+        return url, target
+
     for attempt in range(1, RETRY + 1):
+        total = 0
+        out = None
         try:
             with session.get(url, stream=True, timeout=TIMEOUT) as r:
                 r.raise_for_status()
-                fname = Path(url).name or "download.zip"
-                target = dest / fname
-                target.parent.mkdir(parents=True, exist_ok=True)
-
-                with open(target, "wb") as f, tqdm(
-                    total=int(r.headers.get("content-length", 0)),
-                    unit="B", unit_scale=True, desc=fname, leave=False
-                ) as bar:
-                    for chunk in r.iter_content(chunk_size=CHUNK):
-                        if chunk:
-                            f.write(chunk)
-                            bar.update(len(chunk))
+                total = int(r.headers.get("content-length") or 0)
+                if total:
+                    _advance(bar, total=total)
+                if 0 < total <= SMALL_FILE:
+                    # 小文件不走流式循环：一次 read 拿到全部正文，一次写入
+                    part.write_bytes(r.raw.read(decode_content=True))
+                    part.replace(target)
+                    _advance(bar, total)
+                    return url, target
+
+                # 和 iter_content 一样解开 gzip 等传输编码，读写循环交给 shutil
+                r.raw.decode_content = True
+                with open(part, "wb", buffering=WRITE_BUFFER) as f:
+                    _preallocate(f, total)
+                    # 长度未知（chunked）时不计入总进度条，免得总量失真
+                    out = _CountingWriter(f, bar if total else None)
+                    shutil.copyfileobj(r.raw, out, CHUNK)
+                    out.flush()
+                    f.truncate()   # 解码后的实际长度可能小于 content-length
+                part.replace(target)
+                if not total:
+                    tqdm.write(f"📄 {fname} 下载完成（{target.stat().st_size} 字节）")
                 return url, target
         except Exception as e:
-            if attempt == RETRY:
-                print(f"⚠️ 下载失败 {url} : {e}")
-                return url, None
-            time.sleep(2 ** attempt)
+            # 失败的尝试不计入总进度条，也不留下半截的 .part
+            _advance(bar, -(out.counted if out else 0), -total)
+            part.unlink(missing_ok=True)
+            # 状态码和建连错误已由 Retry 处理；它管不到读正文途中断开，这里整个重下
+            if attempt < RETRY and isinstance(e, urllib3.exceptions.HTTPError):
+                continue
+            print(f"⚠️ 下载失败 {url} : {e}")
+            return url, None
 
 def create_bundle(files: list[Path], idx: int):
     """把 files 列表里的文件打包成 bundles/bundle-{idx}.zip"""
     BUNDLE_DIR.mkdir(exist_ok=True)
     bundle_path = BUNDLE_DIR / f"bundle-{idx:03d}.zip"
-    with zipfile.ZipFile(bundle_path, "w", zipfile.ZIP_DEFLATED) as zf:
+    compression = zipfile.ZIP_DEFLATED if BUNDLE_COMPRESS else zipfile.ZIP_STORED
+    # zipfile 每次只写 8 KiB，外面套 1 MiB 写缓冲，合并成大块 write(2)
+    with open(bundle_path, "wb", buffering=WRITE_BUFFER) as raw, zipfile.ZipFile(
+        raw, "w", compression, allowZip64=True, compresslevel=COMPRESS_LEVEL
+    ) as zf:
         for f in files:
             zf.write(f, arcname=f.name)
+    # 已经进包的中间文件不再需要，及时删掉，磁盘占用不再是 2 倍
+    for f in files:
+        f.unlink(missing_ok=True)
     return bundle_path
 
 # ---------- 主流程 ----------
 def main():
     DOWNLOAD_DIR.mkdir(exist_ok=True)
-    links = list(read_links(LINKS_FILE))
+    links = list(dict.fromkeys(read_links(LINKS_FILE)))   # 去重并保持原有顺序
     if not links:
         print("⚠️ 未发现有效链接")
         return
 
+    _warm_up(links)
     print(f"📦 启动 {WORKERS} 线程并行下载 {len(links)} 个文件")
-    downloaded = []
-    with ThreadPoolExecutor(max_workers=WORKERS) as pool:
-        future_to_url = {pool.submit(_fetch, url, DOWNLOAD_DIR): url for url in links}
-        for fut in tqdm(as_completed(future_to_url), total=len(links), desc="总进度"):
-            _, local_path = fut.result()
-            if local_path:
-                downloaded.append(local_path)
+    total = 0
+    pending = []
+    bundles = []   # [(future, 文件数)]
+    # 打包（压缩 / CRC）是 CPU 密集型，放进进程池，不和下载线程抢 GIL；
+    # 下载线程仍在运行，用 spawn 而不是 fork 创建子进程
+    with ProcessPoolExecutor(max_workers=os.cpu_count(),
+                             mp_context=multiprocessing.get_context("spawn")) as packer:
+        with tqdm(total=0, unit="B", unit_scale=True, desc="下载") as bar, \
+                ThreadPoolExecutor(max_workers=WORKERS) as pool:
+            future_to_url = {pool.submit(_fetch, url, DOWNLOAD_DIR, bar): url for url in links}
+            for fut in tqdm(as_completed(future_to_url), total=len(links), desc="总进度"):
+                _, local_path = fut.result()
+                if not local_path:
+                    continue
+                total += 1
+                pending.append(local_path)
+                # 凑满 BUNDLE_SIZE 个就立即提交打包：刚写完的文件还在页缓存里，
+                # 打包时读不到磁盘，而且打包和其余下载重叠进行
+                if len(pending) == BUNDLE_SIZE:
+                    bundles.append((packer.submit(create_bundle, pending, len(bundles) + 1), len(pending)))
+                    pending = []
+
+        if pending:
+            bundles.append((packer.submit(create_bundle, pending, len(bundles) + 1), len(pending)))
+        for job, count in bundles:
+            print(f"✅ 已创建 {job.result()}  包含 {count} 个文件")
 
-    # 每 BUNDLE_SIZE 个文件打一包
-    total = len(downloaded)
     if total == 0:
         print("❌ 没有成功下载任何文件")
         return
 
-    bundles = [downloaded[i:i+BUNDLE_SIZE] for i in range(0, total, BUNDLE_SIZE)]
-    for idx, group in enumerate(bundles, 1):
-        bundle_zip = create_bundle(group, idx)
-        print(f"✅ 已创建 {bundle_zip}  包含 {len(group)} 个文件")
-
     print(f"🎉 全部完成，共 {total} 个文件 → {len(bundles)} 个压缩包")
 
 if __name__ == "__main__":